@@ -1,26 +1,81 @@
 from fastmcp import FastMCP, Context
 import httpx
-from urllib.parse import urlencode
+import orjson
+from cachetools import TTLCache
 from typing import Any, Dict
 import logging
+import logging.handlers
+import queue
+import atexit
 import os
 import uuid
-import requests
 from datetime import datetime
 import zoneinfo
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+
+# Shared client so concurrent tool calls reuse pooled keep-alive connections;
+# HTTP/2 (needs httpx[http2]) multiplexes them over a single connection.
+# Opened by the server lifespan, so it always belongs to the running loop.
+_HTTP: httpx.AsyncClient
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    global _HTTP
+    client = httpx.AsyncClient(
+        http2=find_spec("h2") is not None,
+        follow_redirects=True,
+        timeout=httpx.Timeout(connect=2.0, read=10.0, write=10.0, pool=5.0),
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+    )
+    _HTTP = client
+    try:
+        yield
+    finally:
+        await client.aclose()
+
 
-mcp = FastMCP("My MCP Server")
+mcp = FastMCP("My MCP Server", lifespan=_lifespan)
 
 
+SEARCH_URL = "https://qsc.quasiris.de/api/v1/search/ab/products"
 QSC_URL = "https://qsc-dev.quasiris.de/api/v1/data/bulk/qsc/demo/messages"
 QSC_TOKEN = os.environ.get("X_QSC_TOKEN") 
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+if not QSC_TOKEN:
+    raise RuntimeError("Missing X_QSC_TOKEN environment variable")
+_BERLIN = zoneinfo.ZoneInfo("Europe/Berlin")
+_QSC_HEADERS = {
+    "Content-Type": "application/json",
+    "X-QSC-Token": QSC_TOKEN,
+}
+
+# Upper bound on a search response body, so one huge listing cannot blow up RSS
+MAX_SEARCH_RESPONSE_BYTES = 8 * 1024 * 1024
+# How much of an upstream error body is read and echoed back
+MAX_ERROR_BODY_BYTES = 2000
+
+# Tool handlers only enqueue records; a background thread writes them to stderr
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Only merge the message args here; the listener's handler applies the layout
+_log_enqueue = logging.handlers.QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))
+
+logging.basicConfig(level=logging.INFO, handlers=[_log_enqueue])
 logger = logging.getLogger("mcp-server")
 
+# Raw bodies of successful search responses keyed by normalized query. Sized in
+# bytes, and hits are re-parsed so every caller gets its own dict.
+SEARCH_CACHE_MAX_BYTES = 32 * 1024 * 1024
+SEARCH_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=SEARCH_CACHE_MAX_BYTES, ttl=60, getsizeof=len)
+
 @mcp.tool
 def greet(name: str) -> str:
     logger.info("Tool called: greet(name=%r)", name)
@@ -28,7 +83,7 @@ def greet(name: str) -> str:
 
 
 @mcp.tool
-def search_products(q: str) -> Dict[str, Any]:
+async def search_products(q: str) -> Dict[str, Any]:
     """
     Proxy a product search to Quasiris Search Cloud and return the JSON.
     
@@ -42,22 +97,44 @@ def search_products(q: str) -> Dict[str, Any]:
     if not isinstance(q, str) or not q.strip():
         return {"error": "Parameter 'q' must be a non-empty string."}
 
-    params = {"q": q}
-    url = f"https://qsc.quasiris.de/api/v1/search/ab/products?{urlencode(params)}"
+    cache_key = q.strip().lower()
+    cached = _SEARCH_CACHE.get(cache_key)
+    if cached is not None:
+        return orjson.loads(cached)
 
     try:
-        with httpx.Client(timeout=10000, follow_redirects=True) as client:
-            resp = client.get(url)
-            resp.raise_for_status()
-            # Expect JSON response from the upstream
-            return resp.json()
-    except httpx.HTTPStatusError as e:
-        return {
-            "error": "Upstream HTTP error",
-            "status_code": e.response.status_code,
-            "url": str(e.request.url),
-            "body": e.response.text[:2000],  # avoid huge payloads
-        }
+        async with _HTTP.stream("GET", SEARCH_URL, params={"q": q}) as resp:
+            if not resp.is_success:
+                # Only read the start of the error body; it is echoed back truncated
+                head = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    head += chunk
+                    if len(head) >= MAX_ERROR_BODY_BYTES:
+                        break
+                return {
+                    "error": "Upstream HTTP error",
+                    "status_code": resp.status_code,
+                    "url": str(resp.url),
+                    "body": bytes(head[:MAX_ERROR_BODY_BYTES]).decode(
+                        resp.encoding or "utf-8", errors="replace"
+                    ),
+                }
+
+            body = bytearray()
+            async for chunk in resp.aiter_bytes():
+                body += chunk
+                if len(body) > MAX_SEARCH_RESPONSE_BYTES:
+                    return {
+                        "error": "Upstream response too large",
+                        "limit_bytes": MAX_SEARCH_RESPONSE_BYTES,
+                        "url": str(resp.url),
+                    }
+
+        # Expect JSON response from the upstream
+        data = orjson.loads(body)
+        if len(body) <= SEARCH_CACHE_MAX_ENTRY_BYTES:
+            _SEARCH_CACHE[cache_key] = bytes(body)
+        return data
     except httpx.RequestError as e:
         return {"error": f"Network error: {str(e)}"}
     except ValueError as e:
@@ -68,20 +145,18 @@ def search_products(q: str) -> Dict[str, Any]:
 
 
 @mcp.tool
-def send_message(message: str, ctx: Context) -> dict:
+async def send_message(message: str, ctx: Context) -> dict:
     """
     send a message to the qsc
     """
 
     msg_id = str(uuid.uuid4())
 
-    doc = {
-            "id": msg_id,
-            "type" : "message",
-            "message": message
-    }
+    payload = _new_payload(msg_id)
+    payload["type"] = "message"
+    payload["message"] = message
 
-    r = send_to_qsc_with_doc_id(msg_id, doc);
+    r = await _post_to_qsc(msg_id, _envelope(msg_id, payload))
 
     #ctx.info(f"QSC responded with {r.status}")
 
@@ -89,7 +164,7 @@ def send_message(message: str, ctx: Context) -> dict:
 
 
 @mcp.tool
-def add_to_cart(cartId: str, customerId: str, sku: str, ctx: Context) -> dict:
+async def add_to_cart(cartId: str, customerId: str, sku: str, ctx: Context) -> dict:
     """
     add the product with the sku to the cart
 
@@ -100,80 +175,92 @@ def add_to_cart(cartId: str, customerId: str, sku: str, ctx: Context) -> dict:
 
     msg_id = str(uuid.uuid4())
 
-    doc = {
-            "id": msg_id,
-            "type": "addToCart",
-            "cartId" : cartId,
-            "sku" : sku,
-            "customerId" : customerId
-    }
+    payload = _new_payload(msg_id)
+    payload["type"] = "addToCart"
+    payload["cartId"] = cartId
+    payload["sku"] = sku
+    payload["customerId"] = customerId
 
-    r = send_to_qsc_with_doc_id(msg_id, doc);
+    r = await _post_to_qsc(msg_id, _envelope(msg_id, payload))
 
     #ctx.info(f"QSC responded with {r.status}")
 
     return r
 
-def send_to_qsc(data: dict) -> dict:
+async def send_to_qsc(data: dict) -> dict:
     """
     Send a dict to QSC with an automatically generated UUID as id.
     """
     doc_id = str(uuid.uuid4())
-    return _send_to_qsc_internal(doc_id, data)
+    return await _send_to_qsc_internal(doc_id, data)
 
 
-def send_to_qsc_with_doc_id(doc_id: str, data: dict) -> dict:
+async def send_to_qsc_with_doc_id(doc_id: str, data: dict) -> dict:
     """
     Send a dict to QSC with a given id.
     If doc_id is empty or None, a UUID will be generated.
     """
     if not doc_id:
         doc_id = str(uuid.uuid4())
-    return _send_to_qsc_internal(doc_id, data)
+    return await _send_to_qsc_internal(doc_id, data)
 
 
-def _send_to_qsc_internal(doc_id: str, data: dict) -> dict:
+async def _send_to_qsc_internal(doc_id: str, data: dict) -> dict:
     """
     Internal helper for sending data to QSC.
     """
-    if not QSC_TOKEN:
-        raise RuntimeError("Missing X_QSC_TOKEN environment variable")
+    payload = _new_payload(doc_id)
+    payload.update(data)
+
+    return await _post_to_qsc(doc_id, _envelope(doc_id, payload))
+
+
+def _new_payload(doc_id: str) -> dict:
+    """
+    Start a QSC payload with the fields every document carries.
+    """
+    return {
+        "id": doc_id,
+        "timestamp": datetime.now(_BERLIN).isoformat()
+    }
 
-    documents = [{
+
+def _envelope(doc_id: str, payload: dict) -> list:
+    """
+    Wrap a payload in the QSC bulk update envelope.
+    """
+    return [{
         "header": {
             "id": doc_id,
             "action": "update"
         },
-        "payload": {
-            "id": doc_id,
-            "timestamp": datetime.now(zoneinfo.ZoneInfo("Europe/Berlin")).isoformat(),
-            **data
-        }
+        "payload": payload
     }]
 
+
+async def _post_to_qsc(doc_id: str, documents: list) -> dict:
+    """
+    Internal helper for posting an already built bulk envelope to QSC.
+    """
     try:
-        with httpx.Client(timeout=10, follow_redirects=True) as client:
-            resp = client.post(
-                QSC_URL,
-                json=documents,
-                headers={
-                    "Content-Type": "application/json",
-                    "X-QSC-Token": QSC_TOKEN
-                },
-            )
-            return {
-                "id": doc_id,
-                "status": resp.status_code,
-                "ok": resp.is_success,
-                "text": resp.text
-            }
+        resp = await _HTTP.post(
+            QSC_URL,
+            content=orjson.dumps(documents),
+            headers=_QSC_HEADERS,
+        )
+        return {
+            "id": doc_id,
+            "status": resp.status_code,
+            "ok": resp.is_success,
+            "text": resp.text
+        }
     except Exception as e:
         logger.error("Failed to send to QSC: %s", e)
         return {
                 "id": doc_id,
                 "status": 500,
-                "ok": resp.is_success,
-                "text": resp.text
+                "ok": False,
+                "text": str(e)
             }
 
 